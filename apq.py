@@ -3,13 +3,22 @@
 Parse Postfix mailq and return a filtered list as JSON
 """
 
-import sys, subprocess, re, time, datetime, argparse, json
-from collections import OrderedDict
+import sys, subprocess, re, time, datetime, argparse, json, functools, mmap, tempfile
+
+try:
+    # Much faster than the stdlib json module on large queues; optional.
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
 MONTH_MAP = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
 UNIX_EPOCH = datetime.datetime(1970, 1, 1)
 MAILQ_EXE = ["/usr/sbin/postqueue", "-p"]
-MAILQ_EMPTY = "Mail queue is empty".lower()
+MAILQ_EMPTY = b"Mail queue is empty".lower()
+HEX_DIGITS = b'0123456789ABCDEF'
+# 256-entry table: HEX_FIRST[byte] is 1 when the byte is an uppercase hex
+# digit, so classifying a line is a single indexed load on its first byte.
+HEX_FIRST = bytes(1 if c in HEX_DIGITS else 0 for c in range(256))
 # Status codes
 ST_ACTIVE = "active"
 ST_HELD = "held"
@@ -18,64 +27,137 @@ ST_DEFER = "deferred"
 
 def call_mailq(args):
     """
-    Call mailq and return stdout as a string
+    Call mailq and yield its output line by line as bytes (trailing newlines
+    removed), so parsing can start before postqueue finishes and the whole
+    queue never has to sit in memory at once. Lines stay undecoded; the
+    parsers decode individual fields as they store them.
     """
     if not args.mailq_data:
-        cmd = subprocess.Popen(MAILQ_EXE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode not in (0, 69):
-            print("Error: mailq failed: \"{}\"".format(stderr.strip()), file=sys.stderr)
-        if stdout:
-            # Popen returns a binary string.
-            stdout = stdout.decode('utf-8')
+        # stderr goes to a temp file rather than a pipe: the child can never
+        # block on a full stderr buffer while we're still draining stdout.
+        with tempfile.TemporaryFile() as errf:
+            cmd = subprocess.Popen(MAILQ_EXE, stdout=subprocess.PIPE, stderr=errf)
+            try:
+                for line in cmd.stdout:
+                    yield line.rstrip(b'\n')
+            finally:
+                # Runs on normal exhaustion and when the consumer abandons
+                # the generator early (e.g. on "Mail queue is empty"), so the
+                # return code is always checked.
+                cmd.stdout.close()
+                if cmd.wait() not in (0, 69):
+                    errf.seek(0)
+                    stderr = errf.read().decode('utf-8', 'replace')
+                    print("Error: mailq failed: \"{}\"".format(stderr.strip()), file=sys.stderr)
     else:
-        with open(args.mailq_data, 'r') as f:
-            stdout = f.read()
-    return stdout.strip()
+        with open(args.mailq_data, 'rb') as f:
+            for line in f:
+                yield line.rstrip(b'\n')
 
 
 def parse_mq_old(args):
     """
     Parse mailq output and return data as a dict.
     """
-    mailq_stdout = call_mailq(args)
     curmsg = None
     msgs = {}
-    for line in mailq_stdout.splitlines():
-        if not line or line[:10] == '-Queue ID-' or line[:2] == '--' or MAILQ_EMPTY in line.lower():
+    for line in call_mailq(args):
+        if not line or line[:10] == b'-Queue ID-' or line[:2] == b'--' or MAILQ_EMPTY in line.lower():
             continue
-        if line[0] in '0123456789ABCDEF':
+        if HEX_FIRST[line[0]]:
             s = line.split()
             curmsg = s[0]
-            if curmsg[-1] == '*':
+            if curmsg[-1:] == b'*':
                 status = 'active'
                 curmsg = curmsg[:-1]
-            elif curmsg[-1] == '|':
+            elif curmsg[-1:] == b'|':
                 status = 'held'
                 curmsg = curmsg[:-1]
             else:
                 status = 'deferred'
+            curmsg = curmsg.decode('utf-8')
             msgs[curmsg] = {
-                'size': s[1],
-                'rawdate': ' '.join(s[2:6]),
-                'sender': s[-1],
+                'size': s[1].decode('utf-8'),
+                'rawdate': b' '.join(s[2:6]).decode('utf-8'),
+                'sender': s[-1].decode('utf-8'),
                 'reason': '',
                 'status': status,
                 }
-        elif '@' in line:  # XXX: pretty dumb check
+        elif b'@' in line:  # XXX: pretty dumb check
             msg = msgs[curmsg]
             if not msg.get("recipients"):
-                msg["recipients"] = [line.strip()]
+                msg["recipients"] = [line.strip().decode('utf-8')]
             else:
-                msg["recipients"].append(line.strip())
-        elif line.lstrip(' ')[0] == '(':
-            msgs[curmsg]['reason'] = line.strip()[1:-1].replace('\n', ' ')
+                msg["recipients"].append(line.strip().decode('utf-8'))
+        elif line.lstrip(b' ')[:1] == b'(':
+            msgs[curmsg]['reason'] = line.strip()[1:-1].decode('utf-8')
         else:
-            print("Error: Unknown line in mailq output: %s" % line, file=sys.stderr)
+            print("Error: Unknown line in mailq output: %s" % line.decode('utf-8', 'replace'), file=sys.stderr)
             sys.exit(1)
     return msgs
 
 
+class Msg:
+    """
+    One queued message. Slots store the fields at fixed offsets, which is
+    several times smaller than a dict per message on large queues.
+    """
+    __slots__ = ('size', 'rawdate', 'sender', 'status', 'recipients', 'date', '_epoch',
+                 '_sender_lc', '_rcpt_lc')
+
+    def __init__(self, size, rawdate, sender, status, recipients):
+        self.size = size
+        self.rawdate = rawdate
+        self.sender = sender
+        self.status = status
+        self.recipients = recipients
+        self.date = None
+        self._epoch = None
+        self._sender_lc = None
+        self._rcpt_lc = None
+
+    def sender_lc(self):
+        """
+        Lowercased sender, folded once and cached for the literal matchers.
+        """
+        if self._sender_lc is None:
+            self._sender_lc = self.sender.lower()
+        return self._sender_lc
+
+    def recipients_lc(self):
+        """
+        Lowercased (reason, addresses) shadows of the recipients, folded once
+        and cached for the literal matchers.
+        """
+        if self._rcpt_lc is None:
+            self._rcpt_lc = [
+                (r.get("reason", "").lower(), [a.lower() for a in r["addresses"]])
+                for r in self.recipients
+            ]
+        return self._rcpt_lc
+
+    def _asdict(self):
+        """
+        Plain-dict view for the JSON/YAML output path.
+        """
+        d = {
+            'size': self.size,
+            'rawdate': self.rawdate,
+            'sender': self.sender,
+            'status': self.status,
+            'recipients': self.recipients,
+        }
+        if self.date is not None:
+            d['date'] = self.date
+        return d
+
+
+# Tokenizes a queue header line (id + optional status marker, size, arrival
+# date, sender) in one C-level match instead of split() plus re-slicing.
+MQ_HDR_RE = re.compile(rb'([^\s*|]+)([*|]?) +(\d+) +(\S+ +\S+ +\S+ +\S+) +(\S+)\s*$')
+MQ_HDR_STATUS = {b'*': ST_ACTIVE, b'|': ST_HELD, b'': ST_DEFER}
+
+
 def _append_recipients(reason, addresses, recipients):
     if len(addresses) > 0:
         recipient = {
@@ -99,8 +181,9 @@ def parse_mq(args):
     MQ_STATE_RCPT = 2
     MQ_STATE_REASON = 3
     MQ_STATE_DONE = 4
-    HEX_DIGITS = '0123456789ABCDEF'
-    msgs = OrderedDict()
+    # Accumulate (queue_id, msg) pairs and build the dict once at the end,
+    # instead of growing (and rehashing) it one insert at a time.
+    records = []
     msg = None
     queue_id = None
     addresses = None
@@ -110,136 +193,170 @@ def parse_mq(args):
         print(msg, file=sys.stderr)
         sys.exit(exit_code)
 
-    mailq_stdout = call_mailq(args)
     state = MQ_STATE_HDR
 
-    for line in mailq_stdout.splitlines():
+    for line in call_mailq(args):
+        # Classify on the first byte once instead of slicing the line
+        # several times per branch.
+        first = line[:1]
         if state == MQ_STATE_DONE:
-            _quit("Unexpected input: %s".format(line))
-        elif not line or line[:10] == '-Queue ID-':
+            # The old buffered reader stripped trailing blank lines; keep
+            # ignoring them now that input is streamed.
+            if line:
+                _quit("Unexpected input: {}".format(line.decode('utf-8', 'replace')))
+            continue
+        elif not first or (first == b'-' and line.startswith(b'-Queue ID-')):
             if state == MQ_STATE_RCPT:
                 _append_recipients(reason, addresses, recipients)
-                msg["recipients"] = recipients
                 state = MQ_STATE_MSG_DATA
             continue
-        elif line.lower() == MAILQ_EMPTY:
+        elif first in b'Mm' and line.lower() == MAILQ_EMPTY:
             if state != MQ_STATE_HDR:
-                _quit("Unexpected input: %s".format(line))
+                _quit("Unexpected input: {}".format(line.decode('utf-8', 'replace')))
             # Mailq Empty.
-            return msgs
-        elif line[:2] == "--":
+            return dict(records)
+        elif first == b'-' and line.startswith(b'--'):
             if state != MQ_STATE_REASON and state != MQ_STATE_MSG_DATA:
-                _quit("Expected delay reason, got {}".format(line))
+                _quit("Expected delay reason, got {}".format(line.decode('utf-8', 'replace')))
                 sys.exit(1)
             # This should be the last line, it will be safe to just continue.
             state = MQ_STATE_DONE
             continue
-        elif line[0] in HEX_DIGITS:
-            if state == MQ_STATE_RCPT:
-                # this is a new message
-                msg["recipients"] = recipients
-            s = line.split()
-            queue_id = s[0]
-            if queue_id[-1] == '*':
-                status = ST_ACTIVE
-                queue_id = queue_id[:-1]
-            elif queue_id[-1] == '|':
-                status = ST_HELD
-                queue_id = queue_id[:-1]
-            else:
-                status = ST_DEFER
-            msg = {
-                'size': s[1],
-                'rawdate': ' '.join(s[2:6]),
-                'sender': s[-1],
-                'status': status,
-            }
-            msgs[queue_id] = msg
-            state = MQ_STATE_RCPT if status == ST_ACTIVE else MQ_STATE_REASON
+        elif HEX_FIRST[line[0]]:
+            m = MQ_HDR_RE.match(line)
+            if not m:
+                _quit("Malformed queue header line: {}".format(line.decode('utf-8', 'replace')))
+            queue_id, flag, size, rawdate, sender = m.groups()
+            status = MQ_HDR_STATUS[flag]
+            # The record carries its recipients list from the start, so no
+            # fix-up assignment is needed when the message ends.
             recipients = []
             addresses = []
-            continue
-        elif line.lstrip(' ')[0] == '(':
-            if state != MQ_STATE_REASON and state != MQ_STATE_RCPT:
-                _quit("Unexpected state for input \"{}\"".format(line.strip()))
-            if state == MQ_STATE_RCPT:
-                # New reason and set of recipients.
-                # Save current data first
-                _append_recipients(reason, addresses, recipients)
-
-            reason = line.strip()[1:-1].replace('\n', ' ')
-            state = MQ_STATE_RCPT
-            addresses = []
-            continue
-        elif '@' in line:  # XXX: pretty dumb check
-            if state != MQ_STATE_RCPT:
-                _quit("Expected recipient address, got \"{}\"".format(line.strip()))
-            addresses.append(line.strip())
+            msg = Msg(
+                size=size.decode('utf-8'),
+                # Re-join on single spaces to keep rawdate identical to the
+                # old split()-based output for day numbers padded by ctime.
+                rawdate=b' '.join(rawdate.split()).decode('utf-8'),
+                sender=sender.decode('utf-8'),
+                status=status,
+                recipients=recipients,
+            )
+            records.append((queue_id.decode('utf-8'), msg))
+            state = MQ_STATE_RCPT if status == ST_ACTIVE else MQ_STATE_REASON
             continue
         else:
-            _quit("Unknown input line: {}".format(line))
+            # Reason or recipient line: strip() once and reuse the result,
+            # instead of a throwaway lstrip(' ') copy just to peek at the
+            # first non-space character. The b'@' containment test below runs
+            # on the raw bytes (a single C-level memchr) and fields are only
+            # decoded at the point they are stored.
+            stripped = line.strip()
+            if stripped[:1] == b'(':
+                if state != MQ_STATE_REASON and state != MQ_STATE_RCPT:
+                    _quit("Unexpected state for input \"{}\"".format(stripped.decode('utf-8', 'replace')))
+                if state == MQ_STATE_RCPT:
+                    # New reason and set of recipients.
+                    # Save current data first
+                    _append_recipients(reason, addresses, recipients)
+
+                # Lines are already newline-split, so the old
+                # replace('\n', ' ') could never match and only allocated.
+                reason = stripped[1:-1].decode('utf-8')
+                state = MQ_STATE_RCPT
+                addresses = []
+            elif b'@' in line:  # XXX: pretty dumb check
+                if state != MQ_STATE_RCPT:
+                    _quit("Expected recipient address, got \"{}\"".format(stripped.decode('utf-8', 'replace')))
+                addresses.append(stripped.decode('utf-8'))
+            else:
+                _quit("Unknown input line: {}".format(line.decode('utf-8', 'replace')))
+            continue
+
+    return dict(records)
 
-    return msgs
+
+# One pass over each syslog line: timestamp, postfix daemon and queue id are
+# captured by a single C-level match instead of split() plus prefix tests.
+MAIL_LOG_RE = re.compile(rb'(\w{3} +\d+ \d+:\d+:\d+) \S+ postfix/(smtpd|qmgr|smtp|cleanup)\[\d+\]: (\w+): (.*)')
 
 
 def parse_ml():
     """
     Read and parse messages from /var/log/mail.log
-    XXX: can be optimised as per parse_mq
     """
     lines = 0
     msgs = {}
     with open('/var/log/mail.log', 'rb') as f:
-        for line in f.readlines():
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            return msgs
+        match = MAIL_LOG_RE.match
+        for line in iter(mm.readline, b''):
             lines += 1
             if lines % 100000 == 0:
                 # Technically off by one
                 print('Processed %s lines (%s messages)...' % (lines, len(msgs)), file=sys.stderr)
             try:
-                l = line.strip().split()
-                if l[4][:13] == 'postfix/smtpd' and l[6][:7] == 'client=':
-                    curmsg = l[5].rstrip(':')
+                m = match(line)
+                if not m:
+                    continue
+                date, module, queue_id, rest = m.groups()
+                if module == b'smtpd' and rest[:7] == b'client=':
+                    curmsg = queue_id.decode('utf-8')
                     if curmsg not in msgs:
+                        client = rest.split(None, 1)[0]
                         msgs[curmsg] = {
-                            'source_ip': l[6].rsplit('[')[-1].rstrip(']'),
-                            'date': parse_syslog_date(' '.join(l[0:3])),
+                            'source_ip': client.rsplit(b'[')[-1].rstrip(b']').decode('utf-8'),
+                            'date': parse_syslog_date(' '.join(date.decode('utf-8').split())),
                         }
-                elif False and l[4][:15] == 'postfix/cleanup' and l[6][:11] == 'message-id=': # dont want msgid right now
-                    curmsg = l[5].rstrip(':')
-                    if curmsg in msgs:
-                        msgid = l[6].split('=', 1)[1]
-                        if msgid[0] == '<' and msgid[-1] == '>':
-                            # Not all message-ids are wrapped in < brackets >
-                            msgid = msgid[1:-1]
-                        msgs[curmsg]['message-id'] = msgid
-                elif l[4][:12] == 'postfix/qmgr' and l[6][:5] == 'from=':
-                    curmsg = l[5].rstrip(':')
+                # postfix/cleanup message-id lines are matched by MAIL_LOG_RE
+                # but intentionally ignored: we don't want msgid right now.
+                elif module == b'qmgr' and rest[:5] == b'from=':
+                    curmsg = queue_id.decode('utf-8')
                     if curmsg in msgs:
-                        msgs[curmsg]['sender'] = l[6].split('<', 1)[1].rsplit('>')[0]
-                elif l[4][:13] == 'postfix/smtp[' and any([i[:7] == 'status=' for i in l]):
-                    curmsg = l[5].rstrip(':')
-                    if curmsg in msgs:
-                        status_field = [i for i in l if i[:7] == 'status='][0]
-                        status = status_field.split('=')[1]
-                        msgs[curmsg]['delivery-status'] = status
+                        msgs[curmsg]['sender'] = rest.split(b'<', 1)[1].rsplit(b'>')[0].decode('utf-8')
+                elif module == b'smtp':
+                    # One backwards scan: status= sits near the end of the
+                    # line, so reversed() usually finds it in a few steps.
+                    status_field = next((i for i in reversed(rest.split()) if i[:7] == b'status='), None)
+                    if status_field:
+                        curmsg = queue_id.decode('utf-8')
+                        if curmsg in msgs:
+                            status = status_field.split(b'=')[1].decode('utf-8')
+                            msgs[curmsg]['delivery-status'] = status
             except Exception:
                 print('Warning: could not parse log line: %s' % repr(line), file=sys.stderr)
+        mm.close()
     print("Processed %s lines (%s messages)..." % (lines, len(msgs)), file=sys.stderr)
     return msgs
 
 
+MAILQ_DATE_RE = re.compile(r'\S+\s+(\w{3})\s+(\d+)\s+(\d{2}):(\d{2}):(\d{2})')
+
+
+@functools.lru_cache(maxsize=None)
+def _mailq_date_to_epoch(d, year):
+    """
+    Convert a mailq date string to epoch seconds assuming 'year'. Cached
+    because large queues contain many messages with identical timestamps
+    (same delivery batch).
+    """
+    mon_str, day, hour, minute, second = MAILQ_DATE_RE.match(d).groups()
+    dt = datetime.datetime(year=year, month=MONTH_MAP[mon_str], day=int(day), hour=int(hour), minute=int(minute), second=int(second))
+    return float((dt - UNIX_EPOCH).total_seconds())
+
+
 def parse_mailq_date(d, now):
     """
     Convert mailq plain text date string to unix epoch time
     """
-    _, mon_str, day, time_str = d.split()
-    hour, minute, second = time_str.split(':')
-    d = datetime.datetime(year=now.year, month=MONTH_MAP[mon_str], day=int(day), hour=int(hour), minute=int(minute), second=int(second))
+    epoch = _mailq_date_to_epoch(d, now.year)
     # Catch messages generated "last year" (eg in Dec when you're running apq on Jan 1)
-    if d > now:
-        d = datetime.datetime(year=now.year-1, month=MONTH_MAP[mon_str], day=int(day), hour=int(hour), minute=int(minute), second=int(second))
-    #return float(d.strftime('%s'))
-    return float((d - UNIX_EPOCH).total_seconds())
+    if epoch > (now - UNIX_EPOCH).total_seconds():
+        epoch = _mailq_date_to_epoch(d, now.year - 1)
+    return epoch
 
 
 def parse_syslog_date(d):
@@ -253,74 +370,172 @@ def parse_syslog_date(d):
     return time.mktime(t)
 
 
+@functools.lru_cache(maxsize=32)
+def _compile_ci(pattern):
+    """
+    Compile a case-insensitive regex, caching the result so repeated filter
+    calls with the same pattern don't recompile it.
+    """
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _literal_needle(pattern):
+    """
+    Return the lowercased pattern when it contains no regex metacharacters
+    (the common case: a domain or an address), else None. Literal needles
+    skip the backtracking regex engine and can match against pre-lowercased
+    shadows, folding case once per message instead of once per match.
+    """
+    if re.escape(pattern) == pattern:
+        return pattern.lower()
+    return None
+
+
+def _key_predicate(pattern, key):
+    """
+    Predicate: 'key' is set on the message and its value matches 'pattern'.
+    """
+    needle = _literal_needle(pattern)
+    if needle is not None:
+        def pred(msg):
+            if isinstance(msg, Msg):
+                if key == 'sender':
+                    return needle in msg.sender_lc()
+                value = getattr(msg, key, None)
+            else:
+                value = msg.get(key)
+            return value is not None and needle in value.lower()
+
+        return pred
+
+    search = _compile_ci(pattern).search
+
+    def pred(msg):
+        if isinstance(msg, Msg):
+            value = getattr(msg, key, None)
+        else:
+            value = msg.get(key)
+        return value is not None and bool(search(value))
+
+    return pred
+
+
+def _reason_predicate(pattern):
+    """
+    Predicate: any delay reason on the (non-active) message matches 'pattern'.
+    Log-only dict entries from parse_ml carry no status or recipients and
+    never match.
+    """
+    needle = _literal_needle(pattern)
+    if needle is not None:
+        def pred(msg):
+            if not isinstance(msg, Msg) or msg.status == ST_ACTIVE:
+                return False
+            for reason_lc, _ in msg.recipients_lc():
+                if reason_lc and needle in reason_lc:
+                    return True
+            return False
+
+        return pred
+
+    search = _compile_ci(pattern).search
+
+    def pred(msg):
+        if not isinstance(msg, Msg) or msg.status == ST_ACTIVE:
+            return False
+        for recipient in msg.recipients:
+            reason = recipient["reason"]
+            if reason and search(reason):
+                return True
+        return False
+
+    return pred
+
+
+def _recipient_predicate(pattern):
+    """
+    Predicate: any recipient address of the message matches 'pattern'.
+    Log-only dict entries from parse_ml carry no recipients and never match.
+    """
+    needle = _literal_needle(pattern)
+    if needle is not None:
+        def pred(msg):
+            if not isinstance(msg, Msg):
+                return False
+            for _, addresses_lc in msg.recipients_lc():
+                if any(needle in address for address in addresses_lc):
+                    return True
+            return False
+
+        return pred
+
+    search = _compile_ci(pattern).search
+
+    def pred(msg):
+        if not isinstance(msg, Msg):
+            return False
+        for recipient in msg.recipients:
+            if any(search(address) for address in recipient["addresses"]):
+                return True
+        return False
+
+    return pred
+
+
+AGE_UNIT_SECS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def _age_predicate(condition, age):
+    """
+    Predicate: the message 'date' meets 'condition' maxage/minage checking
+    against 'age'. The cutoff is precomputed once so each message is a single
+    float compare, instead of building a datetime per message.
+    """
+    assert condition in ['minage', 'maxage']
+    age_secs = int(age[:-1]) * AGE_UNIT_SECS[age[-1]]
+    cutoff = datetime.datetime.now().timestamp() - age_secs
+    if condition == 'minage':
+        return lambda msg: msg.date <= cutoff
+    return lambda msg: msg.date >= cutoff
+
+
 def filter_on_msg_key(msgs, pattern, key):
     """
     Filter msgs, returning only ones where 'key' exists and the value matches regex 'pattern'.
     """
-    pat = re.compile(pattern, re.IGNORECASE)
-    msgs = dict((msgid, data) for (msgid, data) in msgs.items() if key in data and re.search(pat, data[key]))
-    return msgs
+    pred = _key_predicate(pattern, key)
+    return dict((msgid, data) for (msgid, data) in msgs.items() if pred(data))
 
 
 def filter_on_msg_reason(msgs, pattern):
-    filtered = OrderedDict()
-    pat = re.compile(pattern, re.IGNORECASE)
-    for (queue_id, msg) in msgs.items():
-        if msg["status"] == ST_ACTIVE:
-            continue
-        for recipient in msg["recipients"]:
-            reason = recipient["reason"]
-            if reason and re.search(pat, reason):
-                filtered[queue_id] = msg
-
-    return filtered
+    pred = _reason_predicate(pattern)
+    return dict((queue_id, msg) for (queue_id, msg) in msgs.items() if pred(msg))
 
 
 def filter_on_msg_recipient(msgs, pattern):
-    filtered = OrderedDict()
-    pat = re.compile(pattern, re.IGNORECASE)
-    for (queue_id, msg) in msgs.items():
-        for recipient in msg["recipients"]:
-            addresses = recipient["addresses"]
-            for address in addresses:
-                if re.search(pat, address):
-                    filtered[queue_id] = msg
-
-    return filtered
+    pred = _recipient_predicate(pattern)
+    return dict((queue_id, msg) for (queue_id, msg) in msgs.items() if pred(msg))
 
 
 def filter_on_msg_age(msgs, condition, age):
     """
     Filter msgs, returning only items where key 'date' meets 'condition' maxage/minage checking against 'age'.
     """
-    assert condition in ['minage', 'maxage']
-    # Determine age in seconds
-    if age[-1] == 's':
-        age_secs = int(age[:-1])
-    elif age[-1] == 'm':
-        age_secs = int(age[:-1]) * 60
-    elif age[-1] == 'h':
-        age_secs = int(age[:-1]) * 60 * 60
-    elif age[-1] == 'd':
-        age_secs = int(age[:-1]) * 60 * 60 * 24
-    # Create lambda
-    now = datetime.datetime.now()
-    if condition == 'minage':
-        f = lambda d: (now - datetime.datetime.fromtimestamp(d)).total_seconds() >= age_secs
-    elif condition == 'maxage':
-        f = lambda d: (now - datetime.datetime.fromtimestamp(d)).total_seconds() <= age_secs
-    # Filter
-    msgs = dict((msgid, data) for msgid, data in msgs.items() if f(data['date']))
-    return msgs
+    pred = _age_predicate(condition, age)
+    return dict((msgid, data) for msgid, data in msgs.items() if pred(data))
 
 
 def format_msgs_for_output(msgs):
     """
-    Format msgs for output. Currently replaces time_struct dates with a string
+    Format msgs for output. Replaces Msg records with plain dicts and epoch
+    dates with a string.
     """
     for msgid in msgs:
-        if 'date' in msgs[msgid]:
-            msgs[msgid]['date'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(msgs[msgid]['date']))
+        data = msgs[msgid]
+        if isinstance(data, Msg):
+            msgs[msgid] = data = data._asdict()
+        if 'date' in data:
+            data['date'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['date']))
     return msgs
 
 
@@ -370,28 +585,41 @@ def output_msgs(args, msgs):
     """
     if args.count:
         print(len(msgs))
+    elif args.postfix3:
+        # Works straight off the Msg records; no dict conversion needed.
+        # Encode every record first and write once: per-record print() paid
+        # a write syscall (plus a line-buffer flush) per message.
+        if orjson:
+            out = b''.join(orjson.dumps(convert_to_postfix31(queue_id, msg), option=orjson.OPT_APPEND_NEWLINE)
+                           for queue_id, msg in msgs.items())
+            sys.stdout.buffer.write(out)
+        elif msgs:
+            print('\n'.join(json.dumps(convert_to_postfix31(queue_id, msg))
+                            for queue_id, msg in msgs.items()))
     else:
         msgs = format_msgs_for_output(msgs)
         if args.yaml:
             try:
-                import yaml
+                import yaml  # type: ignore[import-untyped]
             except ImportError:
                 print("Error: Can't import yaml. Try installing PyYAML.", file=sys.stderr)
                 sys.exit(1)
             print(yaml.dump(msgs))
-        elif args.postfix3:
-            for queue_id in msgs.keys():
-                msg = msgs[queue_id]
-                p3msg = convert_to_postfix31(queue_id, msg)
-                print(json.dumps(p3msg))
         else:
-            print(json.dumps(msgs, indent=2))
+            if orjson:
+                sys.stdout.buffer.write(orjson.dumps(msgs, option=orjson.OPT_INDENT_2) + b'\n')
+            else:
+                print(json.dumps(msgs, indent=2))
 
 
 def parse_msg_dates(msgs, now):
     new_msgs = {}
     for msgid, data in msgs.items():
-        if 'date' not in data:
+        if isinstance(data, Msg):
+            if data.date is None:
+                data.date = parse_mailq_date(data.rawdate, now)
+                new_msgs[msgid] = data
+        elif 'date' not in data:
             data['date'] = parse_mailq_date(data['rawdate'], now)
             new_msgs[msgid] = data
     return new_msgs
@@ -405,14 +633,14 @@ def convert_to_postfix31(queue_id, msg):
     :return:
     """
     p3m = {
-        "queue_name": msg.get("status"),
+        "queue_name": msg.status,
         "queue_id": queue_id,
-        "arrival_time": int(parse_mailq_date(msg.get("rawdate"), datetime.datetime.now())),
-        "message_size": msg.get("size"),
-        "sender": msg.get("sender"),
+        "arrival_time": msg._epoch,
+        "message_size": msg.size,
+        "sender": msg.sender,
         "recipients": []
     }
-    for recipient in msg["recipients"]:
+    for recipient in msg.recipients:
         reason = recipient["reason"]
         for address in recipient["addresses"]:
             r = {
@@ -441,21 +669,36 @@ def main():
         now = datetime.datetime.now()
         msgs = parse_msg_dates(msgs, now)
 
-    # Filter messages
-    if args.reason:
-        msgs = filter_on_msg_reason(msgs, args.reason)
-    if args.sender:
-        msgs = filter_on_msg_key(msgs, args.sender, 'sender')
-    if args.recipient:
-        msgs = filter_on_msg_recipient(msgs, args.recipient)
-    if args.minage:
-        msgs = filter_on_msg_age(msgs, 'minage', args.minage)
-    if args.maxage:
-        msgs = filter_on_msg_age(msgs, 'maxage', args.maxage)
+    # Filter messages in one fused pass over msgs instead of rebuilding the
+    # dict per filter; cheap checks run first so regexes see fewer messages.
+    checks = []
     if args.exclude_active:
-        msgs = dict((msgid, data) for (msgid, data) in msgs.items() if data.get('status') != 'active')
+        checks.append(lambda msg: getattr(msg, 'status', None) != 'active')
     elif args.only_active:
-        msgs = dict((msgid, data) for (msgid, data) in msgs.items() if data.get('status') == 'active')
+        checks.append(lambda msg: getattr(msg, 'status', None) == 'active')
+    if args.minage:
+        checks.append(_age_predicate('minage', args.minage))
+    if args.maxage:
+        checks.append(_age_predicate('maxage', args.maxage))
+    if args.sender:
+        checks.append(_key_predicate(args.sender, 'sender'))
+    if args.reason:
+        checks.append(_reason_predicate(args.reason))
+    if args.recipient:
+        checks.append(_recipient_predicate(args.recipient))
+    if checks:
+        msgs = dict((msgid, data) for (msgid, data) in msgs.items()
+                    if all(check(data) for check in checks))
+
+    if args.postfix3:
+        # Log-only entries from parse_ml have no rawdate (or recipients) and
+        # can't be rendered as postfix3 records; drop them first.
+        msgs = dict((queue_id, data) for (queue_id, data) in msgs.items() if isinstance(data, Msg))
+        # Parse each arrival time once up front (with a single 'now') so
+        # convert_to_postfix31 is a plain attribute read per message.
+        now = datetime.datetime.now()
+        for data in msgs.values():
+            data._epoch = int(parse_mailq_date(data.rawdate, now))
 
     output_msgs(args, msgs)
 